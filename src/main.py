@@ -1,15 +1,47 @@
+import asyncio
+import csv
+import gzip
+import io
+import logging
 import os
+import queue
+import re
+import shutil
+import tempfile
+import threading
+import time
+import types
+import zlib
+from contextlib import asynccontextmanager, contextmanager
+from functools import lru_cache
 import boto3
-import pandas as pd
+from boto3.s3.transfer import TransferConfig
+from cachetools import TTLCache
+import orjson
+import polars as pl
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from dotenv import load_dotenv
 from databricks.sql import connect
+from databricks.sql.exc import OperationalError
 
 # Load environment variables
 load_dotenv()
 
+# Configure logging; handled errors are logged at ERROR, so only
+# LOG_LEVEL=CRITICAL silences them
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper())
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app):
+    """Close the pooled Databricks connections when the server shuts down."""
+    yield
+    close_databricks_pool()
+
 # Create FastAPI app
-app = FastAPI(title="S3 CSV Databricks Sync")
+app = FastAPI(title="S3 CSV Databricks Sync", lifespan=lifespan)
 
 # AWS S3 Configuration
 AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
@@ -17,13 +49,67 @@ AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
 AWS_REGION = os.getenv('AWS_REGION', 'us-east-2')
 S3_BUCKET = os.getenv('S3_BUCKET')
 
+# Objects above the threshold are downloaded as concurrent 8 MB range requests
+S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=8,
+    use_threads=True
+)
+
 # Databricks Configuration
 DATABRICKS_HOST = os.getenv('DATABRICKS_HOST')
 DATABRICKS_TOKEN = os.getenv('DATABRICKS_TOKEN')
 DATABRICKS_HTTP_PATH = os.getenv('DATABRICKS_HTTP_PATH')
+DATABRICKS_POOL_SIZE = int(os.getenv('DATABRICKS_POOL_SIZE', '4'))
+# Seconds a pooled connection may sit idle before it is closed instead of reused
+DATABRICKS_IDLE_TIMEOUT = int(os.getenv('DATABRICKS_IDLE_TIMEOUT', '300'))
+
+# Number of CSV rows parsed, inserted and streamed per batch; bounds memory use
+CSV_CHUNK_SIZE = int(os.getenv('CSV_CHUNK_SIZE', '100000'))
+
+# First bytes of every gzip stream
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Maximum number of bound parameters per multi-row INSERT statement
+INSERT_MAX_PARAMS = 256
+
+# Databricks column types parsed with a declared dtype instead of inference
+CSV_DTYPES = {
+    'STRING': pl.Utf8,
+    'BIGINT': pl.Int64,
+    'INT': pl.Int32,
+    'SMALLINT': pl.Int16,
+    'TINYINT': pl.Int8,
+    'DOUBLE': pl.Float64,
+    'FLOAT': pl.Float32,
+    'BOOLEAN': pl.Boolean,
+    'DATE': pl.Date,
+    'TIMESTAMP': pl.Datetime,
+    'TIMESTAMP_NTZ': pl.Datetime
+}
+
+# Plain [catalog.][schema.]table identifiers accepted as table names
+TABLE_NAME_PATTERN = re.compile(r'[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*){0,2}')
+
+# Table column names cached per process for SCHEMA_CACHE_TTL seconds, as
+# read-only mappings shared by every caller
+SCHEMA_CACHE_TTL = int(os.getenv('SCHEMA_CACHE_TTL', '60'))
+_table_schema_cache = TTLCache(maxsize=256, ttl=SCHEMA_CACHE_TTL)
+_table_schema_cache_lock = threading.Lock()
+
+# Idle Databricks connections kept open for reuse across requests, as
+# (connection, time it was returned) pairs
+_databricks_pool = queue.LifoQueue(maxsize=DATABRICKS_POOL_SIZE)
 
+@lru_cache(maxsize=1)
 def get_s3_client():
-    """Create and return an S3 client."""
+    """
+    Create and return an S3 client.
+    
+    The client is built once per process and reused; boto3 clients are
+    thread-safe, so worker threads can share it.
+    """
     try:
         return boto3.client(
             's3',
@@ -37,12 +123,7 @@ def get_s3_client():
 def get_databricks_connection():
     """Create and return a Databricks SQL connection."""
     try:
-        # Print connection details for debugging
-        print(f"Connecting to Databricks with:")
-        print(f"Host: {DATABRICKS_HOST}")
-        print(f"HTTP Path: {DATABRICKS_HTTP_PATH}")
-        print(f"Token: {DATABRICKS_TOKEN[:5]}...{DATABRICKS_TOKEN[-5:]}")
-        
+        logger.debug("Connecting to Databricks host %s, HTTP path %s", DATABRICKS_HOST, DATABRICKS_HTTP_PATH)
         conn = connect(
             server_hostname=DATABRICKS_HOST.replace('https://', ''),
             http_path=DATABRICKS_HTTP_PATH,
@@ -51,161 +132,613 @@ def get_databricks_connection():
         return conn
     except Exception as e:
         # Log the full error details
-        import traceback
-        print(f"Databricks Connection Error: {str(e)}")
-        print("Traceback:")
-        traceback.print_exc()
+        logger.exception("Databricks Connection Error: %s", e)
         raise HTTPException(status_code=500, detail=f"Error connecting to Databricks: {str(e)}")
 
+def take_idle_databricks_connection():
+    """
+    Take the most recently used idle connection from the pool, or None.
+    
+    Connections idle for longer than DATABRICKS_IDLE_TIMEOUT are closed
+    rather than returned, since the server may already have expired
+    their sessions.
+    """
+    while True:
+        try:
+            conn, idle_since = _databricks_pool.get_nowait()
+        except queue.Empty:
+            return None
+        if time.monotonic() - idle_since < DATABRICKS_IDLE_TIMEOUT:
+            return conn
+        close_databricks_connection(conn)
+
+def is_databricks_connection_error(error):
+    """Tell whether an error means the connection or its session is no longer usable."""
+    if isinstance(error, OperationalError):
+        # Includes RequestError, raised when the server cannot be reached
+        return True
+    message = str(error).lower()
+    return 'invalid sessionhandle' in message or 'closed connection' in message
+
+def release_databricks_connection(conn):
+    """Return a connection to the pool, closing it if the pool is full."""
+    try:
+        _databricks_pool.put_nowait((conn, time.monotonic()))
+    except queue.Full:
+        close_databricks_connection(conn)
+
+@contextmanager
+def pooled_databricks_connection(conn=None):
+    """
+    Borrow a Databricks SQL connection from the pool.
+    
+    A new connection is opened only when no idle one is available, unless
+    a connection already taken from the pool is passed in. The connection
+    goes back to the pool on exit, also after ordinary SQL errors such as
+    a missing table. It is closed and discarded only on connection or
+    session errors, or if the caller was interrupted.
+    """
+    if conn is None:
+        conn = take_idle_databricks_connection()
+    if conn is None:
+        conn = get_databricks_connection()
+    
+    try:
+        yield conn
+    except Exception as e:
+        if is_databricks_connection_error(e):
+            close_databricks_connection(conn)
+        else:
+            release_databricks_connection(conn)
+        raise
+    except BaseException:
+        close_databricks_connection(conn)
+        raise
+    
+    release_databricks_connection(conn)
+
+def query_databricks(sql, params=None):
+    """
+    Run a read-only query on a pooled connection.
+    
+    Returns the cursor description and all fetched rows. If a reused
+    connection turns out to be dead, e.g. because its session expired, it
+    is discarded and the query is retried once on a new one; SQL errors
+    are raised as they are. Only use this for reads; a retried write
+    could be applied twice.
+    """
+    def run(conn):
+        with conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.description, cursor.fetchall()
+    
+    idle_conn = take_idle_databricks_connection()
+    if idle_conn is not None:
+        try:
+            with pooled_databricks_connection(idle_conn) as conn:
+                return run(conn)
+        except Exception as e:
+            if not is_databricks_connection_error(e):
+                raise
+            logger.warning("Pooled Databricks connection failed, retrying on a new one: %s", e)
+    
+    with pooled_databricks_connection(get_databricks_connection()) as conn:
+        return run(conn)
+
+def close_databricks_connection(conn):
+    """Close a Databricks connection, ignoring errors from dead sessions."""
+    try:
+        conn.close()
+    except Exception as e:
+        logger.warning("Error closing Databricks connection: %s", e)
+
+def close_databricks_pool():
+    """Close all idle pooled Databricks connections."""
+    while True:
+        try:
+            conn, _ = _databricks_pool.get_nowait()
+        except queue.Empty:
+            break
+        close_databricks_connection(conn)
+
+def get_cached_table_schema(table_name):
+    """Return the cached schema of a table, or None if it is not cached."""
+    with _table_schema_cache_lock:
+        return _table_schema_cache.get(table_name.lower())
+
 def get_table_schema(table_name):
-    """Retrieve the schema of a Databricks table."""
+    """
+    Retrieve the columns of a Databricks table and their data types.
+    
+    Columns are looked up in information_schema with bound parameters and
+    returned as a read-only mapping of the lower-cased column name to its
+    data type, since Databricks identifiers are case-insensitive. Catalog
+    and schema default to the session's current ones when table_name is
+    not fully qualified. Tables information_schema does not cover, such as
+    hive_metastore ones, or workspaces where it cannot be queried, are
+    looked up with DESCRIBE TABLE instead. Results are cached for
+    SCHEMA_CACHE_TTL seconds; a table with no columns found is an error
+    and is never cached.
+    """
+    columns = get_cached_table_schema(table_name)
+    if columns is not None:
+        return columns
+    
+    cache_key = table_name.lower()
+    
+    catalog, schema, table = ([None, None] + cache_key.split('.'))[-3:]
     try:
-        with get_databricks_connection() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute(f"DESCRIBE TABLE {table_name}")
-                schema = cursor.fetchall()
-                return [col[0] for col in schema]
+        try:
+            _, rows = query_databricks(
+                "SELECT column_name, data_type FROM system.information_schema.columns "
+                "WHERE table_catalog = COALESCE(%(catalog)s, current_catalog()) "
+                "AND table_schema = COALESCE(%(schema)s, current_schema()) "
+                "AND table_name = %(table)s",
+                {"catalog": catalog, "schema": schema, "table": table}
+            )
+            columns = {row[0].lower(): row[1] for row in rows}
+        except Exception as info_schema_error:
+            # e.g. no Unity Catalog, or no access to the system catalog
+            logger.warning("information_schema lookup failed, using DESCRIBE TABLE: %s", info_schema_error)
+            columns = {}
+        if not columns:
+            _, rows = query_databricks(f"DESCRIBE TABLE {quote_table_name(table_name)}")
+            for col_name, data_type, *_ in rows:
+                # Partition and detail sections follow a blank or "#" row
+                if not col_name or col_name.startswith('#'):
+                    break
+                columns[col_name.lower()] = data_type
+        if not columns:
+            raise ValueError(f"No columns found for table {table_name}")
+        columns = types.MappingProxyType(columns)
+        with _table_schema_cache_lock:
+            _table_schema_cache[cache_key] = columns
+        return columns
     except Exception as e:
-        # Log the full error details
-        import traceback
-        print(f"Error retrieving table schema: {str(e)}")
-        print("Traceback:")
-        traceback.print_exc()
+        # Callers recover from this, so skip the traceback
+        logger.error("Error retrieving table schema: %s", e)
         raise HTTPException(status_code=500, detail=f"Error retrieving table schema: {str(e)}")
 
+def quote_identifier(name):
+    """Quote a column name with backticks so reserved words and spaces are safe."""
+    return "`" + str(name).replace("`", "``") + "`"
+
+def validate_table_name(table_name):
+    """Reject table names that are not [catalog.][schema.]table of plain identifiers."""
+    if not TABLE_NAME_PATTERN.fullmatch(table_name):
+        raise HTTPException(status_code=400, detail=f"Invalid table name: {table_name}")
+
+def quote_table_name(table_name):
+    """Validate a table name and quote each of its parts with backticks."""
+    validate_table_name(table_name)
+    return '.'.join(quote_identifier(part) for part in table_name.split('.'))
+
 def update_table_schema(table_name, new_columns):
-    """Update the schema of a Databricks table by adding missing columns."""
+    """
+    Update the schema of a Databricks table by adding missing columns.
+    
+    All columns are added with a single ALTER TABLE ... ADD COLUMNS statement.
+    If that fails (e.g. one of the columns already exists), each column is
+    retried on its own so the remaining ones are still added.
+    """
     try:
-        with get_databricks_connection() as conn:
+        table_sql = quote_table_name(table_name)
+        with pooled_databricks_connection() as conn:
             with conn.cursor() as cursor:
-                for col in new_columns:
-                    try:
-                        cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {col} STRING")
-                    except Exception as e:
-                        print(f"Error adding column {col}: {e}")
+                cols_sql = ', '.join(f"{quote_identifier(col)} STRING" for col in new_columns)
+                try:
+                    cursor.execute(f"ALTER TABLE {table_sql} ADD COLUMNS ({cols_sql})")
+                except Exception as batch_error:
+                    logger.warning("Error adding columns in batch, retrying individually: %s", batch_error)
+                    for col in new_columns:
+                        try:
+                            cursor.execute(f"ALTER TABLE {table_sql} ADD COLUMNS ({quote_identifier(col)} STRING)")
+                        except Exception as e:
+                            logger.error("Error adding column %s: %s", col, e)
         return True
     except Exception as e:
-        print(f"Error in update_table_schema: {e}")
+        logger.error("Error in update_table_schema: %s", e)
         return False
+    finally:
+        # Some columns may have been added even on failure; force a fresh lookup
+        with _table_schema_cache_lock:
+            _table_schema_cache.pop(table_name.lower(), None)
 
-@app.get("/read_csv")
-async def read_csv_from_s3(file_path: str= "customers-100.csv", target_table: str = "workspace.default.customers"):
+def find_missing_columns(csv_columns, table_columns):
     """
-    Read a CSV file from S3, compare its schema with a Databricks table,
-    and update the table schema if needed.
+    Return the CSV columns that are absent from the table, in CSV order.
     
-    :param file_path: Path to the CSV file in the S3 bucket
-    :param target_table: Fully qualified Databricks table name
-    :return: CSV data and schema update details
+    Names are compared case-insensitively against a set, so the diff is
+    linear in the number of columns; case-only duplicates in the CSV are
+    reported once.
+    """
+    known_columns = {col.lower() for col in table_columns}
+    missing_columns = []
+    for col in csv_columns:
+        if col.lower() not in known_columns:
+            known_columns.add(col.lower())
+            missing_columns.append(col)
+    return missing_columns
+
+def download_csv_from_s3(file_path):
+    """
+    Download a CSV object from S3 to a private temporary file.
+    
+    Returns the path of the file; the caller removes it when done.
+    Large objects are fetched with parallel ranged GETs. Gzip-compressed
+    objects are decompressed to disk, so the batched reads that follow
+    never inflate the whole file in memory.
     """
+    # Create S3 client
+    s3_client = get_s3_client()
+    
+    # delete=False so polars can reopen the file by name, which Windows
+    # does not allow while this handle is still open
+    tmp = tempfile.NamedTemporaryFile(suffix='.csv', delete=False)
     try:
-        # Create S3 client
-        s3_client = get_s3_client()
-        
-        # Download the file to a temporary location
-        local_file_path = os.path.basename(file_path)
         try:
-            s3_client.download_file(S3_BUCKET, file_path, local_file_path)
+            s3_client.download_fileobj(S3_BUCKET, file_path, tmp, Config=S3_TRANSFER_CONFIG)
         except Exception as s3_error:
-            print(f"S3 Download Error: {str(s3_error)}")
+            logger.error("S3 Download Error: %s", s3_error)
             raise HTTPException(status_code=404, detail=f"Could not download file from S3: {str(s3_error)}")
-        
-        try:
-            # Read CSV using pandas
-            df = pd.read_csv(local_file_path)
-        except Exception as csv_error:
-            print(f"CSV Read Error: {str(csv_error)}")
-            raise HTTPException(status_code=400, detail=f"Could not read CSV file: {str(csv_error)}")
-        finally:
-            # Always attempt to remove the temporary file
+        # Flushing is a local write; its errors surface as a 500, not an S3 404
+        tmp.close()
+    except BaseException:
+        tmp.close()
+        os.unlink(tmp.name)
+        raise
+    
+    try:
+        return decompress_csv_file(tmp.name)
+    except (gzip.BadGzipFile, EOFError, zlib.error) as gzip_error:
+        logger.error("CSV Read Error: %s", gzip_error)
+        raise HTTPException(status_code=400, detail=f"Could not read CSV file: {str(gzip_error)}")
+
+def decompress_csv_file(csv_path):
+    """
+    Replace a gzip-compressed file with its decompressed content.
+    
+    Returns the path of the plain CSV file, which is csv_path itself if it
+    was not compressed. The original file is removed either way.
+    """
+    try:
+        with open(csv_path, 'rb') as csv_file:
+            if csv_file.peek(2)[:2] != GZIP_MAGIC:
+                return csv_path
+            plain = tempfile.NamedTemporaryFile(suffix='.csv', delete=False)
             try:
-                os.remove(local_file_path)
-            except Exception as remove_error:
-                print(f"Error removing temporary file: {str(remove_error)}")
-        
-        try:
-            # Get current table schema from Databricks
-            current_schema = get_table_schema(target_table)
-        except Exception as schema_error:
-            print(f"Schema Retrieval Error: {str(schema_error)}")
-            # Continue with an empty schema if retrieval fails
-            current_schema = []
+                with plain, gzip.GzipFile(fileobj=csv_file) as compressed:
+                    shutil.copyfileobj(compressed, plain, 1024 * 1024)
+            except BaseException:
+                os.unlink(plain.name)
+                raise
+        os.unlink(csv_path)
+        return plain.name
+    except BaseException:
+        os.unlink(csv_path)
+        raise
+
+def remove_csv_file(csv_path):
+    """Remove a downloaded CSV file, logging rather than raising on failure."""
+    try:
+        os.unlink(csv_path)
+    except OSError as e:
+        logger.warning("Could not remove temporary CSV file %s: %s", csv_path, e)
+
+def iter_csv_batches(csv_path, schema):
+    """
+    Yield a CSV file as DataFrames of about CSV_CHUNK_SIZE rows each.
+    
+    schema must name every column; polars 1.9's batched reader mishandles
+    partial schema overrides, and a complete schema makes every batch
+    parse with the same types.
+    """
+    reader = pl.read_csv_batched(csv_path, schema_overrides=schema, batch_size=CSV_CHUNK_SIZE)
+    while True:
+        batches = reader.next_batches(1)
+        if not batches:
+            return
+        yield batches[0]
+
+def resolve_csv_schema(csv_path, table_schema):
+    """
+    Work out the column types to read a downloaded CSV file with.
+    
+    Types are inferred from every row, so all batches of the file parse
+    the same way. Columns the table already defines use its declared
+    types instead. If a value does not fit (e.g. "N/A" in a DOUBLE
+    column), the inferred types are used for the whole file, so a
+    declared type never turns an otherwise readable CSV into an error;
+    checking this costs one batched pass over the file.
+    """
+    try:
+        inferred = dict(pl.scan_csv(csv_path, infer_schema_length=None).collect_schema())
         
-        # Find missing columns
-        missing_columns = [col for col in df.columns if col not in current_schema]
+        # Map the header to known table column types
+        declared = {}
+        for col, dtype in inferred.items():
+            data_type = table_schema.get(col.lower(), '').upper()
+            if data_type in CSV_DTYPES and CSV_DTYPES[data_type] != dtype:
+                declared[col] = CSV_DTYPES[data_type]
         
-        # Update table schema if needed
-        if missing_columns:
+        if declared:
+            schema = {**inferred, **declared}
             try:
-                update_table_schema(target_table, missing_columns)
-            except Exception as update_error:
-                print(f"Schema Update Error: {str(update_error)}")
-                # Log the error but don't stop the process
-                # Insert data from CSV to table
+                for _ in iter_csv_batches(csv_path, schema):
+                    pass
+                return schema
+            except Exception as dtype_error:
+                logger.warning("CSV does not match declared column types, inferring instead: %s", dtype_error)
+        return inferred
+    except Exception as csv_error:
+        logger.error("CSV Read Error: %s", csv_error)
+        raise HTTPException(status_code=400, detail=f"Could not read CSV file: {str(csv_error)}")
+
+class _RawStream(io.RawIOBase):
+    """Expose a plain read()-only stream (e.g. an S3 body) as raw I/O for io.BufferedReader."""
+    
+    def __init__(self, stream):
+        self._stream = stream
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, b):
+        data = self._stream.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+def read_csv_header(stream):
+    """
+    Read the column names from the first line of a binary CSV stream.
+    
+    Gzip-compressed input is detected from its magic bytes, like polars
+    does, and duplicate names get the same "_duplicated_N" suffixes polars
+    gives them, so the header matches the columns of the parsed file.
+    """
+    if not hasattr(stream, 'peek'):
+        stream = io.BufferedReader(_RawStream(stream))
+    if stream.peek(2)[:2] == GZIP_MAGIC:
+        stream = gzip.GzipFile(fileobj=stream)
+    header = next(csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')), None)
+    if not header:
+        raise ValueError("No columns to parse from file")
+    
+    columns = []
+    duplicates = {}
+    for name in header:
+        if name in duplicates:
+            columns.append(f"{name}_duplicated_{duplicates[name]}")
+            duplicates[name] += 1
+        else:
+            columns.append(name)
+            duplicates[name] = 0
+    return columns
+
+def load_csv_header_from_s3(file_path):
+    """Read only the header row of a CSV object in S3 and return its column names."""
+    s3_client = get_s3_client()
+    
+    try:
+        response = s3_client.get_object(Bucket=S3_BUCKET, Key=file_path)
+    except Exception as s3_error:
+        logger.error("S3 Download Error: %s", s3_error)
+        raise HTTPException(status_code=404, detail=f"Could not download file from S3: {str(s3_error)}")
+    
+    try:
+        # Decode just enough of the stream to parse the first line
+        return read_csv_header(response['Body'])
+    except Exception as csv_error:
+        logger.error("CSV Read Error: %s", csv_error)
+        raise HTTPException(status_code=400, detail=f"Could not read CSV file: {str(csv_error)}")
+    finally:
+        # Drop the connection instead of downloading the rest of the object
+        response['Body'].close()
+
+def insert_table_data(table_name, csv_path, schema):
+    """
+    Insert the rows of a downloaded CSV file into a Databricks table.
+    
+    The file is read CSV_CHUNK_SIZE rows at a time with the given column
+    types; each batch is converted to Python values and sent as multi-row INSERT statements with bound parameters, batching as
+    many rows per statement as fit in INSERT_MAX_PARAMS.
+    
+    The connector interpolates parameters on the client and assumes
+    backslashes are literal, but Databricks string literals treat them as
+    escapes, so backslashes are doubled first. NaN and infinite floats
+    would be emitted as bare identifiers and are inserted as NULL.
+    """
+    table_sql = quote_table_name(table_name)
+    # Literal % in identifiers must be escaped for the connector's %s placeholders
+    cols = ', '.join(quote_identifier(col).replace('%', '%%') for col in schema)
+    row_sql = '(' + ', '.join(['%s'] * len(schema)) + ')'
+    rows_per_batch = max(1, INSERT_MAX_PARAMS // len(schema))
+    floats = pl.col(pl.Float32, pl.Float64)
+    
+    with pooled_databricks_connection() as conn:
+        with conn.cursor() as cursor:
+            for chunk in iter_csv_batches(csv_path, schema):
+                chunk = chunk.with_columns(
+                    pl.col(pl.Utf8).str.replace_all('\\', '\\\\', literal=True),
+                    pl.when(floats.is_finite()).then(floats)
+                )
+                # Native Python values, with nulls as None (NULL)
+                rows = chunk.rows()
+                for start in range(0, len(rows), rows_per_batch):
+                    batch = rows[start:start + rows_per_batch]
+                    values_sql = ', '.join([row_sql] * len(batch))
+                    params = [value for row in batch for value in row]
+                    cursor.execute(f"INSERT INTO {table_sql} ({cols}) VALUES {values_sql}", params)
+            conn.commit()
+
+def iter_csv_response(csv_path, schema, header):
+    """
+    Yield the response JSON piece by piece, CSV_CHUNK_SIZE rows at a time.
+    
+    The rows are read again from the downloaded file, so only one batch
+    is held in memory at a time.
+    
+    header holds the response fields known up front; the rows are streamed
+    as "data" and the row count is emitted last as "total_rows". Errors
+    after the response has started can no longer change its status, so
+    they are logged and end the stream.
+    """
+    total_rows = 0
+    try:
+        yield orjson.dumps(header)[:-1] + b',"data":['
+        for chunk in iter_csv_batches(csv_path, schema):
+            if len(chunk):
+                # polars writes row-oriented JSON natively; strip the enclosing brackets
+                records = chunk.write_json().encode()[1:-1]
+                yield (b',' if total_rows else b'') + records
+                total_rows += len(chunk)
+        yield b'],"total_rows":' + str(total_rows).encode() + b'}'
+    except Exception as e:
+        logger.exception("Error streaming CSV data: %s", e)
+
+async def sync_csv_file(csv_path, target_table, current_schema):
+    """
+    Sync a downloaded CSV file into a table and build the streamed response.
+    
+    The response removes the file once it has been sent.
+    """
+    # Resolve column types once the table schema is known, so declared
+    # types never depend on cache state
+    schema = await asyncio.to_thread(resolve_csv_schema, csv_path, current_schema)
+    csv_columns = list(schema)
+    
+    # Find missing columns
+    missing_columns = find_missing_columns(csv_columns, current_schema)
+    
+    # Update table schema if needed
+    if missing_columns:
         try:
-            with get_databricks_connection() as conn:
-                with conn.cursor() as cursor:
-                    for index, row in df.iterrows():
-                        cols = ', '.join(row.keys())
-                        vals = ', '.join([f"'{val}'" for val in row.values])
-                        cursor.execute(f"INSERT INTO {target_table} ({cols}) VALUES ({vals})")
-                    conn.commit()
-        except Exception as insert_error:
-            print(f"Error inserting data into table: {str(insert_error)}")
+            await asyncio.to_thread(update_table_schema, target_table, missing_columns)
+        except Exception as update_error:
+            logger.error("Schema Update Error: %s", update_error)
+            # Log the error but don't stop the process
+    
+    # Insert data from CSV to table before responding, so the write does
+    # not depend on the client reading the streamed body
+    try:
+        await asyncio.to_thread(insert_table_data, target_table, csv_path, schema)
+    except Exception as insert_error:
+        logger.error("Error inserting data into table: %s", insert_error)
+    
+    # The synchronous generator is iterated in Starlette's threadpool;
+    # the background task also runs if the client disconnects early
+    header = {
+        "csv_columns": csv_columns,
+        "table_columns": sorted(current_schema),
+        "missing_columns": missing_columns
+    }
+    return StreamingResponse(
+        iter_csv_response(csv_path, schema, header),
+        media_type="application/json",
+        background=BackgroundTask(remove_csv_file, csv_path)
+    )
+
+@app.get("/read_csv")
+async def read_csv_from_s3(file_path: str= "customers-100.csv", target_table: str = "workspace.default.customers", schema_only: bool = False):
+    """
+    Read a CSV file from S3, compare its schema with a Databricks table,
+    and update the table schema if needed.
+    
+    Blocking S3 and Databricks calls run in worker threads so the event
+    loop stays free to serve other requests. The CSV is downloaded to a
+    temporary file and read in batches of CSV_CHUNK_SIZE rows: one pass
+    inserts every row, then a second pass streams the rows back.
+    
+    With schema_only, only the CSV header is read and the column diff is
+    returned; the table is neither altered nor written to.
+    
+    :param file_path: Path to the CSV file in the S3 bucket
+    :param target_table: Fully qualified Databricks table name
+    :param schema_only: Only compare the CSV header with the table schema
+    :return: CSV data and schema update details
+    """
+    validate_table_name(target_table)
+    try:
+        # Download the CSV (or read its header) and fetch the current table schema concurrently
+        if schema_only:
+            load_csv = asyncio.to_thread(load_csv_header_from_s3, file_path)
+        else:
+            load_csv = asyncio.to_thread(download_csv_from_s3, file_path)
+        csv_result, current_schema = await asyncio.gather(
+            load_csv,
+            asyncio.to_thread(get_table_schema, target_table),
+            return_exceptions=True
+        )
+        if isinstance(csv_result, BaseException):
+            raise csv_result
+        if isinstance(current_schema, BaseException):
+            logger.error("Schema Retrieval Error: %s", current_schema)
+            # Continue with an empty schema if retrieval fails
+            current_schema = {}
+        if schema_only:
+            csv_columns = csv_result
+            return {
+                "csv_columns": csv_columns,
+                "table_columns": sorted(current_schema),
+                "missing_columns": find_missing_columns(csv_columns, current_schema)
+            }
         
-        return {
-            "data": df.to_dict(orient='records'),
-            "csv_columns": list(df.columns),
-            "table_columns": current_schema,
-            "missing_columns": missing_columns,
-            "total_rows": len(df)
-        }
+        csv_path = csv_result
+        try:
+            return await sync_csv_file(csv_path, target_table, current_schema)
+        except BaseException:
+            remove_csv_file(csv_path)
+            raise
     
     except HTTPException:
         # Re-raise HTTPException to preserve its details
         raise
     except Exception as e:
         # Catch any unexpected errors
-        import traceback
-        print(f"Unexpected Error: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Unexpected Error: %s", e)
         raise HTTPException(status_code=500, detail=f"Unexpected error processing CSV: {str(e)}")
 
 @app.get("/read_table_data")
-async def read_table_data(table_name: str, limit: int = 100):
+def read_table_data(table_name: str, limit: int = 100):
     """
     Read data from a specified SQL table in Databricks.
     
+    A plain def endpoint: FastAPI runs it in its threadpool, so the
+    blocking Databricks query does not stall the event loop.
+    
     :param table_name: Fully qualified table name to read from
     :param limit: Maximum number of rows to return (default: 100)
     :return: Table data, columns, and row count
     """
+    table_sql = quote_table_name(table_name)
     try:
-        with get_databricks_connection() as conn:
-            with conn.cursor() as cursor:
-                # Execute query to get table data
-                cursor.execute(f"SELECT * FROM {table_name} LIMIT {limit}")
-                
-                # Fetch column names
-                columns = [desc[0] for desc in cursor.description]
-                
-                # Fetch data
-                rows = cursor.fetchall()
-                
-                # Convert rows to list of dictionaries
-                data = [dict(zip(columns, row)) for row in rows]
-                
-                return {
-                    "data": data,
-                    "columns": columns,
-                    "total_rows": len(data)
-                }
+        # Execute query to get table data
+        description, rows = query_databricks(f"SELECT * FROM {table_sql} LIMIT {limit}")
+        
+        # Fetch column names
+        columns = [desc[0] for desc in description]
+        
+        # Convert rows to list of dictionaries
+        data = [dict(zip(columns, row)) for row in rows]
+        
+        return {
+            "data": data,
+            "columns": columns,
+            "total_rows": len(data)
+        }
     except Exception as e:
-        import traceback
-        print(f"Error reading table data: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Error reading table data: %s", e)
         raise HTTPException(status_code=500, detail=f"Error reading table data: {str(e)}")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Workers require an import string; loop="auto" picks uvloop (from
+    # uvicorn[standard]) where available and falls back to asyncio on Windows
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",
+        http="httptools",
+        workers=int(os.getenv('WEB_CONCURRENCY', '4'))
+    )